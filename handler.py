@@ -1,14 +1,218 @@
-import runpod
+"""RunPod serverless handler for Z-Image generation via ComfyUI."""
+
+import os
 import time
+import logging
+import random
+import asyncio
+import threading
+import traceback
+from typing import Dict, Any, List, Optional
+
+import runpod
+
+from utils.comfyui_executor import ComfyUIExecutor, ComfyUIError
+from utils.validators import (
+    validate_input,
+    validate_workflow_structure,
+    apply_overrides,
+    load_default_workflow,
+)
+from utils.logger import setup_logger, set_job_context
+
+logger = setup_logger(__name__)
+
+COMFYUI_URL = os.getenv("COMFYUI_URL", "http://127.0.0.1:8188")
+DEFAULT_TIMEOUT = int(os.getenv("WORKFLOW_TIMEOUT", "300"))
+
+# Input fields that are applied to workflow nodes
+_OVERRIDE_KEYS = frozenset(
+    ("prompt", "negative_prompt", "seed", "steps", "cfg", "width", "height")
+)
+
+# Largest seed handed out when the caller asks for a random one (seed == -1)
+MAX_SEED = 2**32 - 1
+
+# Event loop shared by all jobs, running on a background thread
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_LOOP_LOCK = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Return the persistent event loop, starting it on first use.
+
+    Keeping one loop alive for the whole process avoids paying asyncio
+    bootstrap on every job and lets client state bound to the loop
+    (e.g. aiohttp connection pools) outlive a single request.
+
+    Returns:
+        Running event loop
+    """
+    global _LOOP
+
+    with _LOOP_LOCK:
+        if _LOOP is None:
+            _LOOP = asyncio.new_event_loop()
+            threading.Thread(
+                target=_LOOP.run_forever,
+                name="comfyui-event-loop",
+                daemon=True
+            ).start()
+
+    return _LOOP
+
+
+async def execute_workflow_async(
+    workflow: Dict[str, Any],
+    timeout: int = DEFAULT_TIMEOUT,
+    return_format: str = "base64",
+    job_id: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Execute a workflow on ComfyUI and collect the generated images.
+
+    Args:
+        workflow: ComfyUI workflow JSON
+        timeout: Maximum execution time in seconds
+        return_format: "base64" or "url"
+        job_id: Job ID, used as the bucket prefix for uploaded images
+
+    Returns:
+        List of image dictionaries with base64 data or URLs
+    """
+    async with ComfyUIExecutor.shared(COMFYUI_URL) as executor:
+        history = await executor.execute_workflow(workflow, timeout)
+        return await executor.extract_images_from_history(
+            history, return_format, upload_prefix=job_id
+        )
+
+
+def handler(job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Process a single RunPod job.
+
+    Args:
+        job: RunPod job with "id" and "input"
+
+    Returns:
+        Dict with "output" and "status" on success, or "error" details
+    """
+    job_id = job.get("id", "unknown")
+    set_job_context(job_id)
+
+    start_ns = time.perf_counter_ns()
+
+    try:
+        job_input = job.get("input") or {}
+        validated_input = validate_input(job_input)
+
+        # Caller-supplied workflows only receive explicitly requested overrides;
+        # the default workflow receives the validated defaults as well.
+        # Overrides only touch node inputs, so structure is validated before
+        # applying them.
+        if validated_input.workflow:
+            workflow = validated_input.workflow
+            override_keys = _OVERRIDE_KEYS & job_input.keys()
+        else:
+            # Read-only access is safe: apply_overrides copies before modifying
+            workflow = load_default_workflow(shared=True)
+            override_keys = _OVERRIDE_KEYS & validated_input.keys()
+        validate_workflow_structure(workflow)
+
+        override_params = {k: getattr(validated_input, k) for k in override_keys}
+
+        if override_params.get("seed") == -1:
+            override_params["seed"] = random.randint(0, MAX_SEED)
+
+        if override_params:
+            workflow = apply_overrides(workflow, override_params)
+
+        logger.info("Executing workflow", extra={"job_id": job_id})
+
+        future = asyncio.run_coroutine_threadsafe(
+            execute_workflow_async(
+                workflow,
+                DEFAULT_TIMEOUT,
+                validated_input.return_format,
+                job_id
+            ),
+            _get_loop()
+        )
+        try:
+            images = future.result(DEFAULT_TIMEOUT + 5)
+        except TimeoutError:
+            # Don't leave the workflow coroutine running on the shared loop
+            future.cancel()
+            raise
+
+        # Sampler settings were just applied, so report them directly and
+        # only fall back to scanning for the KSampler node when missing
+        metadata = {
+            key: override_params[key]
+            for key in ("seed", "steps", "cfg")
+            if key in override_params
+        }
+        if len(metadata) < 3:
+            for node_data in workflow.values():
+                if node_data.get("class_type") == "KSampler":
+                    inputs = node_data.get("inputs", {})
+                    for key in ("seed", "steps", "cfg"):
+                        metadata.setdefault(key, inputs.get(key))
+                    break
+
+        # Monotonic clock, so NTP adjustments can't skew reported timings
+        duration_ms = (time.perf_counter_ns() - start_ns) // 1_000_000
+        metadata["generation_time"] = duration_ms / 1000
+
+        logger.info("Job completed", extra={
+            "job_id": job_id,
+            "image_count": len(images),
+            "generation_time": metadata["generation_time"]
+        })
+
+        return {
+            "output": {
+                "images": images,
+                "metadata": metadata
+            },
+            "status": "success"
+        }
+
+    except ValueError as e:
+        logger.error(f"Invalid input: {e}")
+        return {
+            "error": str(e),
+            "error_type": "ValueError"
+        }
+    except TimeoutError as e:
+        logger.error(f"Job timed out: {e}")
+        return {
+            "error": str(e),
+            "error_type": "TimeoutError"
+        }
+    except ComfyUIError as e:
+        logger.error(f"ComfyUI error: {e}")
+        return {
+            "error": str(e),
+            "error_type": type(e).__name__
+        }
+    except Exception as e:
+        # Let logging format the traceback only if a handler emits the record
+        logger.error(f"Unexpected error: {e}", exc_info=True)
+        response = {
+            "error": str(e),
+            "error_type": type(e).__name__
+        }
+        if logger.isEnabledFor(logging.DEBUG):
+            response["traceback"] = traceback.format_exc(limit=20)
+        return response
+
+
+# Entry point registered with RunPod. handler() already converts failures
+# into error responses, so it is exposed directly without a wrapper frame.
+safe_handler = handler
+
 
-def handler(job):
-    job_input = job["input"]
-    prompt = job_input.get("prompt")
-    seconds = job_input.get("seconds", 0)
-    
-    # Simulate processing time
-    time.sleep(seconds)
-    
-    return prompt
-
-runpod.serverless.start({"handler": handler})
+if __name__ == "__main__":
+    runpod.serverless.start({"handler": safe_handler})
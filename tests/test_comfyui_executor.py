@@ -0,0 +1,274 @@
+"""Unit tests for ComfyUI executor functions."""
+
+import asyncio
+import io
+import aiohttp
+import orjson
+import pytest
+from types import SimpleNamespace
+from unittest.mock import patch, AsyncMock, MagicMock
+from PIL import Image
+from utils.comfyui_executor import (
+    ComfyUIExecutor,
+    ComfyUIExecutionError,
+    _HEALTHY_AT,
+    _get_session,
+    check_comfyui_health,
+    close_session,
+    url_uploads_enabled
+)
+
+
+BUCKET_ENV = {
+    "BUCKET_ENDPOINT_URL": "https://bucket.example.com",
+    "BUCKET_ACCESS_KEY_ID": "access-key",
+    "BUCKET_SECRET_ACCESS_KEY": "secret-key",
+}
+
+
+class TestSharedSession:
+    """Test the per-loop shared HTTP session."""
+    
+    def test_session_reused_within_loop(self):
+        """Test calls on the same loop share one session."""
+        async def get_twice():
+            first = await _get_session()
+            second = await _get_session()
+            await close_session()
+            return first, second
+        
+        first, second = asyncio.run(get_twice())
+        
+        assert first is second
+        assert first.closed
+    
+    def test_session_per_loop(self):
+        """Test each loop gets its own session and closes only its own."""
+        other_loop = asyncio.new_event_loop()
+        try:
+            other = other_loop.run_until_complete(_get_session())
+            
+            async def get_and_close():
+                session = await _get_session()
+                await close_session()
+                return session
+            
+            session = asyncio.run(get_and_close())
+            
+            assert session is not other
+            assert session.closed
+            assert not other.closed
+            assert other_loop.run_until_complete(_get_session()) is other
+        finally:
+            other_loop.run_until_complete(close_session())
+            other_loop.close()
+
+
+class TestHealthCheck:
+    """Test the cached ComfyUI health check."""
+    
+    @pytest.fixture
+    def session(self):
+        """Create a session stand-in whose /system_stats answers 200."""
+        async def respond():
+            # Yield to the loop like a real request, so callers contend
+            await asyncio.sleep(0)
+            return MagicMock(status=200)
+        
+        session = MagicMock()
+        session.get.return_value.__aenter__ = AsyncMock(side_effect=respond)
+        session.get.return_value.__aexit__ = AsyncMock(return_value=False)
+        _HEALTHY_AT.clear()
+        with patch("utils.comfyui_executor._get_session", AsyncMock(return_value=session)):
+            yield session
+        _HEALTHY_AT.clear()
+    
+    def test_health_cached_within_ttl(self, session):
+        """Test a second check within HEALTH_CACHE_TTL makes no request."""
+        async def check_twice():
+            return await check_comfyui_health(), await check_comfyui_health()
+        
+        assert asyncio.run(check_twice()) == (True, True)
+        session.get.assert_called_once()
+    
+    def test_health_probes_again_after_ttl(self, session):
+        """Test an expired result is probed again."""
+        with patch("utils.comfyui_executor.HEALTH_CACHE_TTL", 0):
+            assert asyncio.run(check_comfyui_health())
+            assert asyncio.run(check_comfyui_health())
+        
+        assert session.get.call_count == 2
+    
+    def test_health_check_across_loops(self, session):
+        """Test health checks work from more than one event loop."""
+        async def check_concurrently():
+            return await asyncio.gather(check_comfyui_health(), check_comfyui_health())
+        
+        with patch("utils.comfyui_executor.HEALTH_CACHE_TTL", 0):
+            assert asyncio.run(check_concurrently()) == [True, True]
+            assert asyncio.run(check_concurrently()) == [True, True]
+
+
+class FakeWebSocket:
+    """Websocket stand-in that yields a fixed list of frames, then closes."""
+    
+    def __init__(self, *events):
+        self.frames = [
+            SimpleNamespace(type=aiohttp.WSMsgType.BINARY, data=event)
+            if isinstance(event, bytes)
+            else SimpleNamespace(type=aiohttp.WSMsgType.TEXT, data=orjson.dumps(event).decode())
+            for event in events
+        ]
+    
+    async def __aiter__(self):
+        for frame in self.frames:
+            yield frame
+
+
+class TestWaitForCompletionWs:
+    """Test waiting for prompt completion over the websocket."""
+    
+    @pytest.fixture
+    def executor(self):
+        """Create an executor whose history holds a finished prompt."""
+        executor = ComfyUIExecutor()
+        executor._get_history = AsyncMock(return_value={"p1": {"outputs": {}}})
+        return executor
+    
+    def _wait(self, executor, ws, check_errors_result=None):
+        """Run _wait_for_completion_ws with the history error scan mocked."""
+        with patch.object(executor, "_check_for_errors",
+                          return_value=check_errors_result or []) as mock_check:
+            history = asyncio.run(executor._wait_for_completion_ws(ws, "p1", 5))
+        return history, mock_check
+    
+    def test_completion_over_websocket(self, executor):
+        """Test an executing frame with no node completes the prompt."""
+        ws = FakeWebSocket(
+            b"preview-image",
+            {"type": "progress", "data": {"value": 1, "max": 8}},
+            {"type": "executing", "data": {"node": "3", "prompt_id": "p1"}},
+            {"type": "executing", "data": {"node": None, "prompt_id": "other"}},
+            {"type": "executing", "data": {"node": None, "prompt_id": "p1"}},
+        )
+        
+        history, mock_check = self._wait(executor, ws)
+        
+        assert history == {"outputs": {}}
+        executor._get_history.assert_awaited_once_with("p1")
+        mock_check.assert_not_called()
+    
+    def test_execution_error_raises(self, executor):
+        """Test an execution_error frame for the prompt raises."""
+        ws = FakeWebSocket(
+            {"type": "execution_error", "data": {
+                "prompt_id": "p1",
+                "node_id": "5",
+                "node_type": "KSampler",
+                "exception_message": "out of memory"
+            }},
+        )
+        
+        with pytest.raises(ComfyUIExecutionError, match="Node 5 \\(KSampler\\): out of memory"):
+            self._wait(executor, ws)
+        executor._get_history.assert_not_awaited()
+    
+    def test_execution_error_for_other_prompt_ignored(self, executor):
+        """Test execution_error frames for other prompts are ignored."""
+        ws = FakeWebSocket(
+            {"type": "execution_error", "data": {"prompt_id": "other", "node_id": "5"}},
+            {"type": "executing", "data": {"node": None, "prompt_id": "p1"}},
+        )
+        
+        history, _ = self._wait(executor, ws)
+        
+        assert history == {"outputs": {}}
+    
+    def test_early_close_checks_history_errors(self, executor):
+        """Test a websocket closed before completion scans the history for errors."""
+        ws = FakeWebSocket(
+            {"type": "executing", "data": {"node": "3", "prompt_id": "p1"}},
+        )
+        
+        history, mock_check = self._wait(executor, ws)
+        
+        assert history == {"outputs": {}}
+        mock_check.assert_called_once_with({"outputs": {}})
+    
+    def test_early_close_reports_history_errors(self, executor):
+        """Test node errors in the history are raised after an early close."""
+        with pytest.raises(ComfyUIExecutionError, match="Node 5: boom"):
+            self._wait(executor, FakeWebSocket(), check_errors_result=["Node 5: boom"])
+
+
+class TestImageUploads:
+    """Test returning images as bucket URLs."""
+    
+    @pytest.fixture
+    def png_bytes(self):
+        """Create PNG image bytes for testing."""
+        buffer = io.BytesIO()
+        Image.new("RGB", (64, 32), color="red").save(buffer, format="PNG")
+        return buffer.getvalue()
+    
+    @pytest.fixture
+    def history(self):
+        """Create an execution history with one output image."""
+        return {
+            "outputs": {
+                "9": {"images": [{"filename": "out.png", "subfolder": "", "type": "output"}]}
+            }
+        }
+    
+    @pytest.fixture
+    def bucket_env(self, monkeypatch):
+        """Configure bucket credentials."""
+        for name, value in BUCKET_ENV.items():
+            monkeypatch.setenv(name, value)
+    
+    @pytest.fixture
+    def no_bucket_env(self, monkeypatch):
+        """Remove bucket credentials."""
+        for name in BUCKET_ENV:
+            monkeypatch.delenv(name, raising=False)
+    
+    def _extract(self, history, png_bytes, return_format):
+        """Run extract_images_from_history with image downloads mocked."""
+        executor = ComfyUIExecutor()
+        with patch.object(executor, "get_image_data", AsyncMock(return_value=png_bytes)):
+            return asyncio.run(executor.extract_images_from_history(
+                history, return_format, upload_prefix="job-1"
+            ))
+    
+    def test_url_uploads_enabled(self, bucket_env):
+        """Test uploads are enabled with all bucket credentials set."""
+        assert url_uploads_enabled()
+    
+    @pytest.mark.parametrize("missing", sorted(BUCKET_ENV))
+    def test_url_uploads_disabled_without_credential(self, bucket_env, monkeypatch, missing):
+        """Test uploads are disabled if any bucket credential is missing."""
+        monkeypatch.delenv(missing)
+        
+        assert not url_uploads_enabled()
+    
+    def test_extract_images_uploads_to_bucket(self, bucket_env, history, png_bytes):
+        """Test URL output uploads the image instead of inlining it."""
+        with patch("utils.comfyui_executor.rp_upload.upload_in_memory_object",
+                   return_value="https://bucket.example.com/job-1/out.png") as mock_upload:
+            images = self._extract(history, png_bytes, "url")
+        
+        mock_upload.assert_called_once_with("out.png", png_bytes, prefix="job-1")
+        assert len(images) == 1
+        assert images[0]["url"] == "https://bucket.example.com/job-1/out.png"
+        assert "data" not in images[0]
+        assert (images[0]["width"], images[0]["height"]) == (64, 32)
+    
+    def test_extract_images_falls_back_to_base64(self, no_bucket_env, history, png_bytes):
+        """Test URL output falls back to base64 without a bucket."""
+        with patch("utils.comfyui_executor.rp_upload.upload_in_memory_object") as mock_upload:
+            images = self._extract(history, png_bytes, "url")
+        
+        mock_upload.assert_not_called()
+        assert len(images) == 1
+        assert images[0]["data"]
+        assert "url" not in images[0]
@@ -1,5 +1,6 @@
 """Unit tests for handler functions."""
 
+import inspect
 import pytest
 from unittest.mock import patch, MagicMock
 from handler import handler, execute_workflow_async, safe_handler
@@ -187,4 +188,64 @@ class TestHandler:
             assert overrides["steps"] == 30
             assert overrides["cfg"] == 5.0
             assert overrides["width"] == 768
-            assert overrides["height"] == 1024
\ No newline at end of file
+            assert overrides["height"] == 1024
+    
+    def test_handler_metadata_reports_overrides(self):
+        """Test metadata reports the applied sampler parameters."""
+        job = {
+            "id": "test-job-123",
+            "input": {
+                "prompt": "test prompt",
+                "seed": 42,
+                "steps": 30,
+                "cfg": 5.0
+            }
+        }
+        
+        with patch('handler.apply_overrides') as mock_apply, \
+             patch('handler.validate_workflow_structure') as mock_validate, \
+             patch('handler.execute_workflow_async') as mock_execute:
+            
+            mock_apply.return_value = {"10": {"class_type": "UNETLoader", "inputs": {}}}
+            mock_execute.return_value = []
+            
+            result = handler(job)
+            
+            metadata = result["output"]["metadata"]
+            assert metadata["seed"] == 42
+            assert metadata["steps"] == 30
+            assert metadata["cfg"] == 5.0
+    
+    def test_handler_passes_return_format(self):
+        """Test the requested return format reaches image extraction."""
+        job = {
+            "id": "test-job-123",
+            "input": {
+                "prompt": "test prompt",
+                "return_format": "url"
+            }
+        }
+        
+        with patch('handler.validate_workflow_structure'), \
+             patch('handler.execute_workflow_async') as mock_execute:
+            
+            mock_execute.return_value = []
+            
+            handler(job)
+            
+            call = mock_execute.call_args
+            bound = inspect.signature(execute_workflow_async).bind(*call.args, **call.kwargs)
+            assert bound.arguments["return_format"] == "url"
+            assert bound.arguments["job_id"] == "test-job-123"
+    
+    def test_handler_unexpected_error(self, sample_job):
+        """Test unexpected errors are reported with their type."""
+        with patch('handler.validate_input') as mock_validate_input, \
+             patch('handler.logger.isEnabledFor', return_value=False):
+            mock_validate_input.side_effect = RuntimeError("boom")
+            
+            result = handler(sample_job)
+            
+            assert result["error"] == "boom"
+            assert result["error_type"] == "RuntimeError"
+            assert "traceback" not in result
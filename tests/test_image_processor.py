@@ -17,13 +17,14 @@ class TestImageProcessor:
         img = Image.new("RGB", (100, 100), color="red")
         return img
     
-    @pytest.fixture
-    def sample_image_bytes(self, sample_image):
-        """Convert sample image to bytes."""
+    @pytest.fixture(scope="module")
+    def sample_image_bytes(self):
+        """Encode a sample image to PNG bytes once per module."""
+        # Built independently of sample_image, which some tests resize in place
+        img = Image.new("RGB", (100, 100), color="red")
         buffer = io.BytesIO()
-        sample_image.save(buffer, format="PNG")
-        buffer.seek(0)
-        return buffer.read()
+        img.save(buffer, format="PNG")
+        return buffer.getvalue()
     
     def test_encode_to_base64_png(self, sample_image_bytes):
         """Test PNG encoding to base64."""
@@ -50,6 +51,7 @@ class TestImageProcessor:
         # Verify it's actually JPEG
         img = Image.open(io.BytesIO(decoded))
         assert img.format == "JPEG"
+        assert img.info.get("progressive")
     
     def test_encode_to_base64_webp(self, sample_image_bytes):
         """Test WebP encoding to base64."""
@@ -91,6 +93,17 @@ class TestImageProcessor:
         assert optimized.width <= 50
         assert optimized.height <= 50
     
+    def test_optimize_image_resize_jpeg(self):
+        """Test JPEG images are resized via a reduced-scale decode."""
+        buffer = io.BytesIO()
+        Image.new("RGB", (800, 400), color="red").save(buffer, format="JPEG")
+        image = Image.open(io.BytesIO(buffer.getvalue()))
+        
+        optimized = ImageProcessor.optimize_image(image, max_size=(100, 100))
+        
+        assert optimized.size == (100, 50)
+        assert optimized.mode == "RGB"
+    
     def test_optimize_image_no_resize(self, sample_image):
         """Test image optimization without resize."""
         max_size = (200, 200)
@@ -135,6 +148,52 @@ class TestImageProcessor:
         assert result[0]["height"] == 64
         assert "data" in result[0]
     
+    def test_process_comfyui_output_reuses_base64(self, sample_image_bytes):
+        """Test image data is passed through without re-encoding."""
+        encoded = base64.b64encode(sample_image_bytes).decode("ascii")
+        
+        result = ImageProcessor.process_comfyui_output({"images": [{"data": encoded}]})
+        
+        assert result[0]["data"] == encoded
+    
+    def test_process_comfyui_output_wrapped_base64(self):
+        """Test newline-wrapped (MIME) base64 payloads are still processed."""
+        buffer = io.BytesIO()
+        Image.new("RGB", (200, 200), color="red").save(buffer, format="PNG")
+        encoded = base64.encodebytes(buffer.getvalue()).decode("ascii")
+        
+        result = ImageProcessor.process_comfyui_output({"images": [{"data": encoded}]})
+        
+        assert len(result) == 1
+        assert (result[0]["format"], result[0]["width"], result[0]["height"]) == ("png", 200, 200)
+        assert "\n" not in result[0]["data"]
+        assert result[0]["data"] == base64.b64encode(buffer.getvalue()).decode("ascii")
+    
+    def test_process_comfyui_output_crlf_wrapped_base64(self):
+        """Test base64 wrapped with CRLF line breaks is returned as one line."""
+        buffer = io.BytesIO()
+        Image.new("RGB", (200, 200), color="red").save(buffer, format="PNG")
+        encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
+        wrapped = "\r\n".join(encoded[i:i + 76] for i in range(0, len(encoded), 76))
+        
+        result = ImageProcessor.process_comfyui_output({"images": [{"data": wrapped}]})
+        
+        assert len(result) == 1
+        assert result[0]["data"] == encoded
+    
+    def test_process_comfyui_output_header_past_prefix(self):
+        """Test JPEG headers beyond the decoded prefix are found."""
+        buffer = io.BytesIO()
+        Image.new("RGB", (120, 80), color="red").save(
+            buffer, format="JPEG", exif=b"Exif\x00\x00" + b"\x00" * 20000
+        )
+        encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
+        
+        result = ImageProcessor.process_comfyui_output({"images": [{"data": encoded}]})
+        
+        assert len(result) == 1
+        assert (result[0]["format"], result[0]["width"], result[0]["height"]) == ("jpeg", 120, 80)
+    
     def test_process_comfyui_output_empty(self):
         """Test processing empty ComfyUI output."""
         output_data = {}
@@ -169,6 +228,29 @@ class TestImageProcessor:
         assert len(result) == 1
         assert result[0]["format"] == "png"
     
+    def test_read_image_header_png(self, sample_image_bytes):
+        """Test PNG dimensions are read from the header."""
+        assert ImageProcessor.read_image_header(sample_image_bytes) == ("png", 100, 100)
+    
+    def test_read_image_header_jpeg(self):
+        """Test JPEG dimensions are read from the SOF segment."""
+        buffer = io.BytesIO()
+        Image.new("RGB", (120, 80), color="green").save(buffer, format="JPEG")
+        
+        assert ImageProcessor.read_image_header(buffer.getvalue()) == ("jpeg", 120, 80)
+    
+    @pytest.mark.parametrize("save_kwargs", [{}, {"lossless": True}])
+    def test_read_image_header_webp(self, save_kwargs):
+        """Test WebP dimensions are read for lossy and lossless images."""
+        buffer = io.BytesIO()
+        Image.new("RGB", (123, 45), color="blue").save(buffer, format="WEBP", **save_kwargs)
+        
+        assert ImageProcessor.read_image_header(buffer.getvalue()) == ("webp", 123, 45)
+    
+    def test_read_image_header_unknown(self):
+        """Test unrecognized data returns None."""
+        assert ImageProcessor.read_image_header(b"not an image") is None
+    
     def test_supported_formats(self):
         """Test supported formats list."""
         assert "png" in ImageProcessor.SUPPORTED_FORMATS
@@ -2,6 +2,7 @@
 
 import pytest
 import json
+import dataclasses
 from utils.validators import (
     validate_input,
     validate_workflow_structure,
@@ -149,6 +150,66 @@ class TestValidateInput:
             validate_input(input_data)
         
         assert "Validation errors" in str(exc_info.value)
+    
+    def test_validate_input_unexpected_field(self):
+        """Test validation fails for unknown input fields."""
+        input_data = {
+            "prompt": "test",
+            "sampler": "euler"  # Not part of the schema
+        }
+        
+        with pytest.raises(ValueError) as exc_info:
+            validate_input(input_data)
+        
+        assert "sampler" in str(exc_info.value)
+    
+    def test_validate_input_attribute_access(self):
+        """Test validated input exposes fields as read-only attributes."""
+        result = validate_input({"prompt": "test", "steps": 30})
+        
+        assert result.prompt == "test"
+        assert result.steps == 30
+        assert result.workflow is None
+        assert "workflow" not in result
+        assert result.to_dict()["steps"] == 30
+        
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            result.steps = 10
+    
+    def test_validate_input_workflow_only(self):
+        """Test workflow-only input still gets defaults and checks return_format."""
+        workflow = load_default_workflow()
+        
+        result = validate_input({"workflow": workflow, "return_format": "url"})
+        
+        assert result["workflow"] == workflow
+        assert result["return_format"] == "url"
+        assert result["steps"] == 26
+        
+        with pytest.raises(ValueError):
+            validate_input({"workflow": workflow, "return_format": "binary"})
+    
+    def test_validate_input_workflow_json_string(self):
+        """Test workflows sent as JSON strings are parsed."""
+        workflow = load_default_workflow()
+        
+        result = validate_input({"workflow": json.dumps(workflow)})
+        
+        assert result["workflow"] == workflow
+    
+    def test_validate_input_workflow_empty_json_string(self):
+        """Test an empty workflow sent as JSON text counts as missing."""
+        with pytest.raises(ValueError) as exc_info:
+            validate_input({"workflow": "{}"})
+        
+        assert "Missing required field" in str(exc_info.value)
+    
+    def test_validate_input_workflow_invalid_json(self):
+        """Test validation fails for malformed workflow JSON."""
+        with pytest.raises(ValueError) as exc_info:
+            validate_input({"workflow": "{not json"})
+        
+        assert "invalid JSON" in str(exc_info.value)
 
 
 class TestValidateWorkflowStructure:
@@ -220,6 +281,19 @@ class TestValidateWorkflowStructure:
         
         assert "KSampler" in str(exc_info.value)
     
+    def test_validate_workflow_structure_reports_all_missing(self):
+        """Test every missing required node type is reported at once."""
+        workflow = load_default_workflow()
+        workflow = {
+            k: v for k, v in workflow.items()
+            if v.get("class_type") not in ("VAELoader", "KSampler")
+        }
+        
+        with pytest.raises(ValueError) as exc_info:
+            validate_workflow_structure(workflow)
+        
+        assert "KSampler, VAELoader" in str(exc_info.value)
+    
     def test_validate_workflow_structure_missing_output(self):
         """Test workflow validation fails without output node."""
         workflow = load_default_workflow()
@@ -233,6 +307,15 @@ class TestValidateWorkflowStructure:
             validate_workflow_structure(workflow)
         
         assert "output node" in str(exc_info.value).lower()
+    
+    def test_validate_workflow_structure_renumbered_nodes(self):
+        """Test valid workflows with a different node layout still pass."""
+        workflow = {
+            f"n{node_id}": node_data
+            for node_id, node_data in load_default_workflow().items()
+        }
+        
+        assert validate_workflow_structure(workflow) is True
 
 
 class TestApplyOverrides:
@@ -272,6 +355,30 @@ class TestApplyOverrides:
         
         assert found_negative
     
+    def test_apply_overrides_prompts_follow_sampler_links(self):
+        """Test prompts are applied to the nodes wired into KSampler."""
+        workflow = load_default_workflow()
+        sampler = next(v for v in workflow.values() if v["class_type"] == "KSampler")
+        positive_id = sampler["inputs"]["positive"][0]
+        negative_id = sampler["inputs"]["negative"][0]
+        # Negative text no longer matches the "low quality"/"blurry" heuristic
+        workflow[negative_id]["inputs"]["text"] = "watermark"
+        
+        result = apply_overrides(workflow, {"prompt": "a dog", "negative_prompt": "ugly"})
+        
+        assert result[positive_id]["inputs"]["text"] == "a dog"
+        assert result[negative_id]["inputs"]["text"] == "ugly"
+    
+    def test_apply_overrides_prompt_keeps_negative(self):
+        """Test a prompt override leaves the negative prompt untouched."""
+        workflow = load_default_workflow()
+        sampler = next(v for v in workflow.values() if v["class_type"] == "KSampler")
+        negative_id = sampler["inputs"]["negative"][0]
+        
+        result = apply_overrides(workflow, {"prompt": "a dog"})
+        
+        assert result[negative_id]["inputs"]["text"] == workflow[negative_id]["inputs"]["text"]
+    
     def test_apply_overrides_seed(self):
         """Test seed override application."""
         workflow = load_default_workflow()
@@ -360,6 +467,15 @@ class TestApplyOverrides:
             if node_data.get("class_type") == "KSampler":
                 assert node_data.get("inputs", {}).get("seed") == original_seed
                 break
+    
+    def test_apply_overrides_leaves_shared_workflow_intact(self):
+        """Test overrides never modify the cached default workflow."""
+        shared = load_default_workflow(shared=True)
+        snapshot = json.loads(json.dumps(shared))
+        
+        apply_overrides(shared, {"prompt": "new prompt", "seed": 1, "width": 512})
+        
+        assert shared == snapshot
 
 
 class TestLoadDefaultWorkflow:
@@ -385,3 +501,17 @@ class TestLoadDefaultWorkflow:
         
         has_output = any(t in OUTPUT_NODE_TYPES for t in found_types)
         assert has_output, "Missing output node"
+    
+    def test_load_default_workflow_returns_independent_copies(self):
+        """Test modifying a loaded workflow doesn't affect later loads."""
+        workflow = load_default_workflow()
+        node_id = next(iter(workflow))
+        workflow[node_id]["inputs"]["modified"] = True
+        
+        fresh = load_default_workflow()
+        
+        assert "modified" not in fresh[node_id]["inputs"]
+    
+    def test_load_default_workflow_shared_is_cached(self):
+        """Test shared access returns the same cached object."""
+        assert load_default_workflow(shared=True) is load_default_workflow(shared=True)
@@ -1,13 +1,56 @@
 """ComfyUI workflow execution utilities for RunPod serverless handler."""
 
+import io
 import os
+import time
+import uuid
+import weakref
 import asyncio
 import aiohttp
-from typing import Dict, Any, List, Optional
+import orjson
+import pybase64
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Union
+from PIL import Image
+from runpod.serverless.utils import rp_upload
+from utils.image_processor import ImageProcessor
 from utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+# Register Pillow's format plugins at import (container warmup) rather than
+# on the first image that needs the PIL fallback
+Image.init()
+
+# Connection pool settings for the local ComfyUI API
+CONNECTION_POOL_SIZE = 8
+KEEPALIVE_TIMEOUT = 300
+SOCK_CONNECT_TIMEOUT = 5
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# How long a successful health check is reused before probing again
+HEALTH_CACHE_TTL = 2.0
+
+# Read size when streaming images from /view
+IMAGE_CHUNK_SIZE = 64 * 1024
+
+# Threads for base64 encoding output images (bounded so a large batch
+# can't starve the rest of the process)
+ENCODE_WORKERS = int(os.getenv("ENCODE_WORKERS", "4"))
+
+# Environment variables rp_upload needs to reach the bucket
+BUCKET_ENV_VARS = (
+    "BUCKET_ENDPOINT_URL",
+    "BUCKET_ACCESS_KEY_ID",
+    "BUCKET_SECRET_ACCESS_KEY",
+)
+
+# Event type markers looked for at the start of websocket text frames, so
+# progress/status frames are skipped without being JSON-decoded
+EXECUTING_EVENT_MARKER = '"executing"'
+EXECUTION_ERROR_EVENT_MARKER = '"execution_error"'
+
 
 class ComfyUIError(Exception):
     """Base exception for ComfyUI errors."""
@@ -24,13 +67,116 @@ class ComfyUIExecutionError(ComfyUIError):
     pass
 
 
+_ENCODE_POOL = ThreadPoolExecutor(
+    max_workers=ENCODE_WORKERS,
+    thread_name_prefix="image-encode"
+)
+
+# HTTP session per event loop, shared by all executors and health checks
+# on that loop (a session can only be used on the loop it was created on)
+_SESSIONS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+async def _get_session() -> aiohttp.ClientSession:
+    """
+    Get the running loop's shared HTTP session, creating it on first use.
+    
+    Returns:
+        Shared aiohttp session
+    """
+    loop = asyncio.get_running_loop()
+    session = _SESSIONS.get(loop)
+    if session is None or session.closed:
+        # Keep-alive pool so /prompt, /history and /view calls reuse sockets
+        connector = aiohttp.TCPConnector(
+            limit=CONNECTION_POOL_SIZE,
+            keepalive_timeout=KEEPALIVE_TIMEOUT
+        )
+        session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=SOCK_CONNECT_TIMEOUT)
+        )
+        _SESSIONS[loop] = session
+    return session
+
+
+# Time of the last successful health probe per ComfyUI URL
+_HEALTHY_AT: Dict[str, float] = {}
+
+# Lock serializing health probes, per event loop like the sessions
+_HEALTH_LOCKS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _get_health_lock() -> asyncio.Lock:
+    """Get the running loop's health probe lock, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    lock = _HEALTH_LOCKS.get(loop)
+    if lock is None:
+        lock = _HEALTH_LOCKS[loop] = asyncio.Lock()
+    return lock
+
+
+async def close_session():
+    """Close the running loop's shared HTTP session (e.g. on shutdown)."""
+    session = _SESSIONS.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+def _describe_image(
+    image_bytes: Union[bytes, bytearray],
+    encode: bool = True
+) -> Dict[str, Any]:
+    """
+    Read an image's format and size, optionally base64-encoding it.
+    
+    Args:
+        image_bytes: Raw image bytes
+        encode: Include the base64-encoded image as "data"
+        
+    Returns:
+        Image dictionary with format, width, height (and base64 data)
+    """
+    # Get image info from the header; only unknown formats hit PIL
+    header = ImageProcessor.read_image_header(image_bytes)
+    if header:
+        format_name, width, height = header
+    else:
+        image = Image.open(io.BytesIO(image_bytes))
+        format_name = image.format.lower() if image.format else "png"
+        width, height = image.size
+    
+    image_info = {
+        "format": format_name,
+        "width": width,
+        "height": height
+    }
+    if encode:
+        image_info["data"] = pybase64.b64encode_as_string(image_bytes)
+    return image_info
+
+
+def url_uploads_enabled() -> bool:
+    """Check whether bucket storage is configured for URL responses."""
+    return all(os.getenv(name) for name in BUCKET_ENV_VARS)
+
+
 class ComfyUIExecutor:
     """
     Executes ComfyUI workflows via the ComfyUI API.
     
     The base image includes ComfyUI running on port 8188.
+    
+    Executors on the same event loop share one HTTP session, so entering and
+    exiting the async context manager does not open or tear down connections.
     """
     
+    _shared_instances: Dict[str, "ComfyUIExecutor"] = {}
+    
     def __init__(self, comfyui_url: str = "http://127.0.0.1:8188"):
         """
         Initialize ComfyUI executor.
@@ -40,16 +186,32 @@ class ComfyUIExecutor:
         """
         self.comfyui_url = comfyui_url.rstrip("/")
         self.session: Optional[aiohttp.ClientSession] = None
+    
+    @classmethod
+    def shared(cls, comfyui_url: str = "http://127.0.0.1:8188") -> "ComfyUIExecutor":
+        """
+        Get the process-wide executor for a ComfyUI URL.
+        
+        Args:
+            comfyui_url: URL of the ComfyUI API
+            
+        Returns:
+            Shared executor instance
+        """
+        key = comfyui_url.rstrip("/")
+        if key not in cls._shared_instances:
+            cls._shared_instances[key] = cls(key)
+        return cls._shared_instances[key]
         
     async def __aenter__(self):
         """Async context manager entry."""
-        self.session = aiohttp.ClientSession()
+        self.session = await _get_session()
         return self
         
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         """Async context manager exit."""
-        if self.session:
-            await self.session.close()
+        # The shared session stays open for the next job
+        pass
     
     async def execute_workflow(
         self,
@@ -75,13 +237,20 @@ class ComfyUIExecutor:
         
         logger.info("Starting workflow execution", extra={"timeout": timeout})
         
+        # One id correlates our websocket with the queued prompt
+        client_id = uuid.uuid4().hex
+        ws = await self._connect_websocket(client_id)
+        
         try:
             # Queue the workflow
-            prompt_id = await self._queue_prompt(workflow)
+            prompt_id = await self._queue_prompt(workflow, client_id)
             logger.info(f"Workflow queued with prompt_id: {prompt_id}")
             
             # Wait for completion
-            history = await self._wait_for_completion(prompt_id, timeout)
+            if ws is not None:
+                history = await self._wait_for_completion_ws(ws, prompt_id, timeout)
+            else:
+                history = await self._wait_for_completion(prompt_id, timeout)
             logger.info(f"Workflow completed for prompt_id: {prompt_id}")
             
             return history
@@ -94,13 +263,43 @@ class ComfyUIExecutor:
         except Exception as e:
             logger.error(f"Unexpected error during workflow execution: {e}")
             raise ComfyUIError(f"Unexpected error: {str(e)}")
+        finally:
+            if ws is not None:
+                await ws.close()
+    
+    async def _connect_websocket(
+        self,
+        client_id: str
+    ) -> Optional[aiohttp.ClientWebSocketResponse]:
+        """
+        Open ComfyUI's event websocket for a client ID.
+        
+        Args:
+            client_id: Client ID the prompt will be queued with
+            
+        Returns:
+            Connected websocket, or None if unavailable (callers fall back to
+            polling /history)
+        """
+        url = f"{self.comfyui_url}/ws"
+        
+        try:
+            return await self.session.ws_connect(url, params={"clientId": client_id})
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"ComfyUI websocket unavailable, polling history instead: {e}")
+            return None
     
-    async def _queue_prompt(self, workflow: Dict[str, Any]) -> str:
+    async def _queue_prompt(
+        self,
+        workflow: Dict[str, Any],
+        client_id: Optional[str] = None
+    ) -> str:
         """
         Queue a workflow for execution and return prompt ID.
         
         Args:
             workflow: ComfyUI workflow JSON
+            client_id: Client ID that receives websocket events for the prompt
             
         Returns:
             Prompt ID for tracking
@@ -111,9 +310,16 @@ class ComfyUIExecutor:
         """
         url = f"{self.comfyui_url}/prompt"
         payload = {"prompt": workflow}
+        if client_id:
+            payload["client_id"] = client_id
         
         try:
-            async with self.session.post(url, json=payload) as response:
+            # orjson serializes the workflow straight to UTF-8 bytes
+            async with self.session.post(
+                url,
+                data=orjson.dumps(payload),
+                headers=JSON_HEADERS
+            ) as response:
                 if response.status != 200:
                     error_text = await response.text()
                     logger.error(f"ComfyUI returned error: {error_text}")
@@ -121,7 +327,7 @@ class ComfyUIExecutor:
                         f"ComfyUI returned status {response.status}: {error_text}"
                     )
                 
-                data = await response.json()
+                data = orjson.loads(await response.read())
                 prompt_id = data.get("prompt_id")
                 
                 if not prompt_id:
@@ -133,10 +339,67 @@ class ComfyUIExecutor:
             logger.error(f"Failed to connect to ComfyUI: {e}")
             raise ComfyUIConnectionError(f"Failed to connect to ComfyUI: {str(e)}")
     
-    async def _wait_for_completion(
+    async def _wait_for_completion_ws(
         self,
+        ws: aiohttp.ClientWebSocketResponse,
         prompt_id: str,
         timeout: int
+    ) -> Dict[str, Any]:
+        """
+        Wait for ComfyUI to report the prompt finished, then fetch its history.
+        
+        Args:
+            ws: Websocket connected with the prompt's client ID
+            prompt_id: Prompt ID to wait for
+            timeout: Maximum time to wait in seconds
+            
+        Returns:
+            Execution history from ComfyUI
+            
+        Raises:
+            TimeoutError: If workflow doesn't complete within timeout
+            ComfyUIExecutionError: If workflow execution fails
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        
+        async def wait_for_done() -> bool:
+            async for msg in ws:
+                # Binary frames carry preview images
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                prefix = msg.data[:40]
+                if EXECUTING_EVENT_MARKER in prefix:
+                    data = orjson.loads(msg.data).get("data", {})
+                    if data.get("node") is None and data.get("prompt_id") == prompt_id:
+                        return True
+                elif EXECUTION_ERROR_EVENT_MARKER in prefix:
+                    data = orjson.loads(msg.data).get("data", {})
+                    if data.get("prompt_id") == prompt_id:
+                        error_msg = (
+                            f"Node {data.get('node_id')} ({data.get('node_type')}): "
+                            f"{data.get('exception_message', 'unknown error')}"
+                        )
+                        logger.error(f"Workflow execution failed: {error_msg}")
+                        raise ComfyUIExecutionError(f"Workflow execution failed: {error_msg}")
+            return False
+        
+        completed = await asyncio.wait_for(wait_for_done(), timeout)
+        
+        # History is usually available immediately; polling covers the short
+        # gap before ComfyUI stores it and a websocket closed early. Errors
+        # would have arrived as execution_error, so the history is only
+        # checked for them if the websocket closed before completion.
+        remaining = max(deadline - loop.time(), 0.0)
+        return await self._wait_for_completion(
+            prompt_id, remaining, check_errors=not completed
+        )
+    
+    async def _wait_for_completion(
+        self,
+        prompt_id: str,
+        timeout: int,
+        check_errors: bool = True
     ) -> Dict[str, Any]:
         """
         Wait for workflow completion and return results.
@@ -144,6 +407,7 @@ class ComfyUIExecutor:
         Args:
             prompt_id: Prompt ID to wait for
             timeout: Maximum time to wait in seconds
+            check_errors: Scan the history outputs for node errors
             
         Returns:
             Execution history from ComfyUI
@@ -152,23 +416,19 @@ class ComfyUIExecutor:
             TimeoutError: If workflow doesn't complete within timeout
             ComfyUIExecutionError: If workflow execution fails
         """
-        start_time = asyncio.get_event_loop().time()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
         poll_interval = 0.1  # Start with 100ms
         max_poll_interval = 2.0  # Max 2 seconds between polls
         
         while True:
-            # Check timeout
-            elapsed = asyncio.get_event_loop().time() - start_time
-            if elapsed >= timeout:
-                raise TimeoutError(f"Workflow execution timed out after {timeout}s")
-            
             # Get history
             history = await self._get_history(prompt_id)
             
             # Check if complete
             if prompt_id in history:
                 # Check for errors in the execution
-                node_errors = self._check_for_errors(history[prompt_id])
+                node_errors = check_errors and self._check_for_errors(history[prompt_id])
                 if node_errors:
                     error_msg = "; ".join(node_errors)
                     logger.error(f"Workflow execution failed: {error_msg}")
@@ -176,8 +436,13 @@ class ComfyUIExecutor:
                 
                 return history[prompt_id]
             
+            # Check timeout (after polling, so a zero budget still gets one look)
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise TimeoutError(f"Workflow execution timed out after {timeout}s")
+            
             # Wait before next poll (with exponential backoff)
-            await asyncio.sleep(poll_interval)
+            await asyncio.sleep(min(poll_interval, remaining))
             poll_interval = min(poll_interval * 1.5, max_poll_interval)
     
     async def _get_history(self, prompt_id: str) -> Dict[str, Any]:
@@ -204,7 +469,13 @@ class ComfyUIExecutor:
                         f"Failed to get history: status {response.status}"
                     )
                 
-                return await response.json()
+                # ComfyUI answers with an empty object until the prompt has
+                # finished; skip JSON parsing for those polls
+                body = await response.read()
+                if body.strip() == b"{}":
+                    return {}
+                
+                return orjson.loads(body)
                 
         except aiohttp.ClientError as e:
             logger.error(f"Failed to connect to ComfyUI: {e}")
@@ -235,10 +506,14 @@ class ComfyUIExecutor:
         filename: str,
         subfolder: str = "",
         image_type: str = "output"
-    ) -> bytes:
+    ) -> Union[bytes, bytearray]:
         """
         Retrieve image data from ComfyUI.
         
+        When the response size is known, the body is streamed into a
+        preallocated buffer instead of being assembled from chunks, so peak
+        memory stays close to a single copy of the image.
+        
         Args:
             filename: Image filename
             subfolder: Subfolder path
@@ -267,57 +542,113 @@ class ComfyUIExecutor:
                         f"Failed to get image: status {response.status}"
                     )
                 
-                return await response.read()
+                size = response.content_length
+                if not size or "Content-Encoding" in response.headers:
+                    return await response.read()
+                
+                buffer = bytearray(size)
+                offset = 0
+                with memoryview(buffer) as view:
+                    async for chunk in response.content.iter_chunked(IMAGE_CHUNK_SIZE):
+                        view[offset:offset + len(chunk)] = chunk
+                        offset += len(chunk)
+                
+                if offset != size:
+                    raise ComfyUIExecutionError(
+                        f"Incomplete image data: got {offset} of {size} bytes"
+                    )
+                
+                return buffer
                 
         except aiohttp.ClientError as e:
             logger.error(f"Failed to connect to ComfyUI: {e}")
             raise ComfyUIConnectionError(f"Failed to connect to ComfyUI: {str(e)}")
     
+    async def _fetch_image(
+        self,
+        filename: str,
+        subfolder: str,
+        image_type: str,
+        return_format: str = "base64",
+        upload_prefix: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Download one output image and build its response entry.
+        
+        Args:
+            filename: Image filename
+            subfolder: Subfolder path
+            image_type: Image type (output, input, temp)
+            return_format: "base64" to inline the image, "url" to upload it
+            upload_prefix: Bucket key prefix for uploaded images
+            
+        Returns:
+            Image dictionary with base64 data or a URL
+        """
+        image_bytes = await self.get_image_data(filename, subfolder, image_type)
+        encode = return_format != "url"
+        
+        # CPU-bound work runs on the encode pool so other downloads proceed
+        loop = asyncio.get_running_loop()
+        image = await loop.run_in_executor(
+            _ENCODE_POOL, _describe_image, image_bytes, encode
+        )
+        
+        if not encode:
+            # Upload skips base64 entirely; the client fetches the bytes
+            image["url"] = await asyncio.to_thread(
+                rp_upload.upload_in_memory_object,
+                filename,
+                bytes(image_bytes),
+                prefix=upload_prefix
+            )
+        
+        image["filename"] = filename
+        return image
+    
     async def extract_images_from_history(
         self,
-        history: Dict[str, Any]
+        history: Dict[str, Any],
+        return_format: str = "base64",
+        upload_prefix: Optional[str] = None
     ) -> List[Dict[str, Any]]:
         """
         Extract images from execution history.
         
         Args:
             history: Execution history from ComfyUI
+            return_format: "base64" to inline images, "url" to upload them
+                to bucket storage (requires the BUCKET_* credentials; falls
+                back to base64 otherwise)
+            upload_prefix: Bucket key prefix for uploaded images
             
         Returns:
-            List of image dictionaries with base64 data
+            List of image dictionaries with base64 data or URLs
         """
-        import base64
-        from utils.image_processor import ImageProcessor
-        
-        images = []
+        if return_format == "url" and not url_uploads_enabled():
+            logger.warning("URL output requested but no bucket is configured; returning base64")
+            return_format = "base64"
         
         try:
-            # Iterate through outputs in history
-            for node_id, node_output in history.get("outputs", {}).items():
-                if "images" in node_output:
-                    for img_info in node_output["images"]:
-                        filename = img_info.get("filename", "")
-                        subfolder = img_info.get("subfolder", "")
-                        image_type = img_info.get("type", "output")
-                        
-                        # Get image data
-                        image_bytes = await self.get_image_data(filename, subfolder, image_type)
-                        
-                        # Encode to base64
-                        base64_data = base64.b64encode(image_bytes).decode("utf-8")
-                        
-                        # Get image info
-                        from PIL import Image
-                        import io
-                        image = Image.open(io.BytesIO(image_bytes))
-                        
-                        images.append({
-                            "data": base64_data,
-                            "format": image.format.lower() if image.format else "png",
-                            "width": image.width,
-                            "height": image.height,
-                            "filename": filename
-                        })
+            # Collect image references from all output nodes
+            image_refs = [
+                (
+                    img_info.get("filename", ""),
+                    img_info.get("subfolder", ""),
+                    img_info.get("type", "output")
+                )
+                for node_output in history.get("outputs", {}).values()
+                for img_info in node_output.get("images", [])
+            ]
+            
+            # Download and encode all images concurrently; each image is
+            # encoded as soon as its own download finishes
+            images = list(await asyncio.gather(
+                *(
+                    self._fetch_image(*ref, return_format, upload_prefix)
+                    for ref in image_refs
+                )
+            ))
             
             logger.info(f"Extracted {len(images)} images from history")
             
@@ -332,16 +663,39 @@ async def check_comfyui_health(comfyui_url: str = "http://127.0.0.1:8188") -> bo
     """
     Check if ComfyUI is healthy and ready.
     
+    A healthy result is reused for HEALTH_CACHE_TTL seconds, and concurrent
+    callers share a single in-flight probe.
+    
     Args:
         comfyui_url: URL of the ComfyUI API
         
     Returns:
         True if ComfyUI is healthy
     """
-    try:
-        async with aiohttp.ClientSession() as session:
-            url = f"{comfyui_url.rstrip('/')}/system_stats"
+    base_url = comfyui_url.rstrip("/")
+    
+    def is_fresh() -> bool:
+        healthy_at = _HEALTHY_AT.get(base_url)
+        return healthy_at is not None and time.monotonic() - healthy_at < HEALTH_CACHE_TTL
+    
+    if is_fresh():
+        return True
+    
+    async with _get_health_lock():
+        # Another caller may have probed while we waited for the lock
+        if is_fresh():
+            return True
+        
+        try:
+            session = await _get_session()
+            url = f"{base_url}/system_stats"
             async with session.get(url, timeout=aiohttp.ClientTimeout(total=5)) as response:
-                return response.status == 200
-    except Exception:
-        return False
+                healthy = response.status == 200
+        except Exception:
+            healthy = False
+        
+        if healthy:
+            _HEALTHY_AT[base_url] = time.monotonic()
+        else:
+            _HEALTHY_AT.pop(base_url, None)
+        return healthy
@@ -1,14 +1,32 @@
 """Image processing and encoding utilities for RunPod serverless handler."""
 
-import base64
+import binascii
 import io
-from typing import Dict, Any, List, Optional
+import os
+import struct
+from typing import Dict, Any, List, Optional, Tuple
 from PIL import Image
 import numpy as np
+import pybase64
 from utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+# zlib level for PNG output (1 = fast; responses are transient, so CPU
+# matters more than the last few percent of size)
+PNG_COMPRESS_LEVEL = int(os.getenv("PNG_COMPRESS_LEVEL", "1"))
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Base64 characters decoded to look for an image header (3 KiB of data;
+# a multiple of 4 so the prefix decodes on its own)
+HEADER_BASE64_PREFIX = 4096
+
+# JPEG start-of-frame markers (all carry height/width at the same offsets)
+JPEG_SOF_MARKERS = frozenset(
+    (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF)
+)
+
 
 class ImageProcessor:
     """Process and encode images from ComfyUI output."""
@@ -43,15 +61,24 @@ class ImageProcessor:
             # Encode to bytes
             buffer = io.BytesIO()
             save_kwargs = {}
-            if format.lower() in ["jpeg", "jpg", "webp"]:
-                save_kwargs["quality"] = quality
-                save_kwargs["optimize"] = True
+            if format.lower() in ["jpeg", "jpg"]:
+                # Progressive scans with optimized Huffman tables are smaller
+                # at the same quality
+                save_kwargs.update(
+                    quality=quality,
+                    optimize=True,
+                    progressive=True,
+                    subsampling="4:2:0"
+                )
+            elif format.lower() == "webp":
+                save_kwargs.update(quality=quality, method=4)
+            elif format.lower() == "png":
+                save_kwargs["compress_level"] = PNG_COMPRESS_LEVEL
             
             image.save(buffer, format=format.upper(), **save_kwargs)
-            buffer.seek(0)
             
-            # Encode to base64
-            base64_string = base64.b64encode(buffer.read()).decode("utf-8")
+            # Encode to base64 (SIMD) straight from the buffer's memory (no bytes copy)
+            base64_string = pybase64.b64encode_as_string(buffer.getbuffer())
             
             logger.debug(f"Encoded image to base64 (format: {format}, size: {len(base64_string)} chars)")
             
@@ -73,7 +100,7 @@ class ImageProcessor:
             Decoded bytes
         """
         try:
-            return base64.b64decode(base64_string)
+            return pybase64.b64decode(base64_string)
         except Exception as e:
             logger.error(f"Failed to decode base64 string: {e}")
             raise
@@ -93,29 +120,23 @@ class ImageProcessor:
         Returns:
             List of processed image dictionaries
         """
-        images = []
-        
         try:
-            # Extract images from output data
-            # ComfyUI output structure varies based on node types
-            if "images" in output_data:
-                for img_data in output_data["images"]:
-                    image_info = ImageProcessor._process_single_image(
-                        img_data, return_format
-                    )
-                    if image_info:
-                        images.append(image_info)
+            # Collect image entries first; ComfyUI output structure varies
+            # based on node types (top-level images and/or history outputs)
+            entries = list(output_data.get("images", ()))
+            for node_output in output_data.get("outputs", {}).values():
+                entries.extend(node_output.get("images", ()))
             
-            # Check for output nodes in history
-            if "outputs" in output_data:
-                for node_id, node_output in output_data["outputs"].items():
-                    if "images" in node_output:
-                        for img_data in node_output["images"]:
-                            image_info = ImageProcessor._process_single_image(
-                                img_data, return_format
-                            )
-                            if image_info:
-                                images.append(image_info)
+            # Process the whole batch in one pass; base64 payloads are passed
+            # through, so no image is decoded or re-encoded through PIL
+            images = [
+                image_info
+                for image_info in (
+                    ImageProcessor._process_single_image(img_data, return_format)
+                    for img_data in entries
+                )
+                if image_info
+            ]
             
             logger.info(f"Processed {len(images)} images from ComfyUI output")
             
@@ -142,22 +163,40 @@ class ImageProcessor:
         """
         try:
             # Extract image data
-            if "data" in img_data:
-                # Image data is already provided
-                image_bytes = base64.b64decode(img_data["data"])
-            else:
+            if "data" not in img_data:
                 # Image data needs to be fetched from ComfyUI
                 # This would require additional API calls
                 logger.warning("Image data not provided in output")
                 return None
             
-            # Get image info
-            image = Image.open(io.BytesIO(image_bytes))
-            width, height = image.size
-            format_name = image.format.lower() if image.format else "png"
+            # The output keeps the source format, so the caller's base64 is
+            # returned as-is instead of being re-encoded through PIL; only
+            # MIME-style line wrapping is removed so responses are one line
+            base64_data = img_data["data"]
+            if isinstance(base64_data, bytes):
+                base64_data = base64_data.decode("ascii")
+            if "\n" in base64_data:
+                base64_data = "".join(base64_data.split())
             
-            # Encode to base64
-            base64_data = ImageProcessor.encode_to_base64(image_bytes, format=format_name)
+            # Get image info from the header; only the start of the payload
+            # is decoded unless the header lies further in (or PIL is needed)
+            try:
+                header = ImageProcessor.read_image_header(
+                    pybase64.b64decode(base64_data[:HEADER_BASE64_PREFIX])
+                )
+            except (binascii.Error, ValueError):
+                # The prefix doesn't decode on its own (e.g. stray
+                # whitespace); decode the whole payload instead
+                header = None
+            if not header:
+                image_bytes = pybase64.b64decode(base64_data)
+                header = ImageProcessor.read_image_header(image_bytes)
+            if header:
+                format_name, width, height = header
+            else:
+                image = Image.open(io.BytesIO(image_bytes))
+                width, height = image.size
+                format_name = image.format.lower() if image.format else "png"
             
             return {
                 "data": base64_data,
@@ -170,6 +209,63 @@ class ImageProcessor:
             logger.error(f"Failed to process single image: {e}")
             return None
     
+    @staticmethod
+    def read_image_header(image_data: bytes) -> Optional[Tuple[str, int, int]]:
+        """
+        Read format and dimensions from PNG/JPEG/WebP headers without decoding.
+        
+        Args:
+            image_data: Raw image bytes
+            
+        Returns:
+            (format, width, height) tuple, or None for other/unrecognized data
+        """
+        # PNG: width/height are the first fields of the IHDR chunk
+        if image_data[:8] == PNG_SIGNATURE and image_data[12:16] == b"IHDR":
+            width, height = struct.unpack(">II", image_data[16:24])
+            return "png", width, height
+        
+        # JPEG: walk marker segments until a start-of-frame segment
+        if image_data[:2] == b"\xff\xd8":
+            offset = 2
+            while offset + 9 <= len(image_data):
+                if image_data[offset] != 0xFF:
+                    return None
+                marker = image_data[offset + 1]
+                if marker == 0xFF:
+                    # Fill byte
+                    offset += 1
+                    continue
+                if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+                    # Standalone markers without a length field
+                    offset += 2
+                    continue
+                if marker in JPEG_SOF_MARKERS:
+                    height, width = struct.unpack(">HH", image_data[offset + 5:offset + 9])
+                    return "jpeg", width, height
+                segment_length = struct.unpack(">H", image_data[offset + 2:offset + 4])[0]
+                offset += 2 + segment_length
+            return None
+        
+        # WebP: RIFF container whose first chunk describes the canvas
+        if image_data[:4] == b"RIFF" and image_data[8:12] == b"WEBP" and len(image_data) >= 30:
+            chunk = image_data[12:16]
+            if chunk == b"VP8X":
+                # Extended format: 24-bit canvas size minus one
+                width = int.from_bytes(image_data[24:27], "little") + 1
+                height = int.from_bytes(image_data[27:30], "little") + 1
+                return "webp", width, height
+            if chunk == b"VP8 " and image_data[23:26] == b"\x9d\x01\x2a":
+                # Lossy: 14-bit dimensions after the keyframe start code
+                width, height = struct.unpack("<HH", image_data[26:30])
+                return "webp", width & 0x3FFF, height & 0x3FFF
+            if chunk == b"VP8L" and image_data[20] == 0x2F:
+                # Lossless: two 14-bit fields (minus one) after the signature
+                bits = int.from_bytes(image_data[21:25], "little")
+                return "webp", (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        
+        return None
+    
     @staticmethod
     def get_image_info(image: Image.Image) -> Dict[str, Any]:
         """
@@ -1,5 +1,6 @@
 """Logging configuration for RunPod serverless handler."""
 
+import functools
 import logging
 import sys
 import os
@@ -26,6 +27,9 @@ def setup_logger(
     """
     Set up a structured logger.
     
+    Loggers are configured once per (name, level, format); repeated calls
+    return the already configured logger.
+    
     Args:
         name: Logger name
         level: Logging level (defaults to LOG_LEVEL env var)
@@ -40,6 +44,12 @@ def setup_logger(
     if log_format is None:
         log_format = get_log_format()
     
+    return _configure_logger(name, level, log_format)
+
+
+@functools.lru_cache(maxsize=None)
+def _configure_logger(name: str, level: int, log_format: str) -> logging.Logger:
+    """Configure a logger's handler, formatter and job context filter."""
     logger = logging.getLogger(name)
     logger.setLevel(level)
     
@@ -64,8 +74,9 @@ def setup_logger(
     handler.setFormatter(formatter)
     logger.addHandler(handler)
     
-    # Add context filter
-    logger.addFilter(ContextFilter())
+    # Share the global context filter so set_job_context reaches every logger
+    logger.removeFilter(context_filter)
+    logger.addFilter(context_filter)
     
     return logger
 
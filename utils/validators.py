@@ -1,13 +1,56 @@
 """Input validation schemas and functions for RunPod serverless handler."""
 
-import json
+import sys
 import copy
-from typing import Dict, Any, Optional
-from runpod.serverless.utils.rp_validator import validate
+import functools
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Callable, FrozenSet, Tuple
+
+import orjson
 from utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+# Default workflow shipped next to handler.py
+DEFAULT_WORKFLOW_PATH = Path(__file__).resolve().parent.parent / "workflow.json"
+
+# Allowed values for enumerated inputs
+ALLOWED_DIMENSIONS: FrozenSet[int] = frozenset((512, 768, 1024, 1280, 1536))
+RETURN_FORMATS: FrozenSet[str] = frozenset(("base64", "url"))
+
+
+def _is_non_blank(value: str) -> bool:
+    """Check that a string has non-whitespace content."""
+    return len(value.strip()) > 0
+
+
+def _is_valid_seed(value: int) -> bool:
+    """Check that a seed is non-negative or -1 (random)."""
+    return value >= -1
+
+
+def _is_valid_steps(value: int) -> bool:
+    """Check that a step count is within 1-100."""
+    return 1 <= value <= 100
+
+
+def _is_valid_cfg(value: float) -> bool:
+    """Check that a CFG scale is within 1.0-20.0."""
+    return 1.0 <= value <= 20.0
+
+
+def _is_allowed_dimension(value: int) -> bool:
+    """Check that an image dimension is one of ALLOWED_DIMENSIONS."""
+    return value in ALLOWED_DIMENSIONS
+
+
+def _is_return_format(value: str) -> bool:
+    """Check that a return format is one of RETURN_FORMATS."""
+    return value in RETURN_FORMATS
+
+
 # Input schema definition
 INPUT_SCHEMA = {
     "workflow": {
@@ -17,7 +60,7 @@ INPUT_SCHEMA = {
     "prompt": {
         "type": str,
         "required": False,  # Optional if workflow is provided
-        "constraints": lambda x: len(x.strip()) > 0,
+        "constraints": _is_non_blank,
     },
     "negative_prompt": {
         "type": str,
@@ -28,68 +71,195 @@ INPUT_SCHEMA = {
         "type": int,
         "required": False,
         "default": -1,  # -1 means random
-        "constraints": lambda x: x >= -1,
+        "constraints": _is_valid_seed,
     },
     "steps": {
         "type": int,
         "required": False,
         "default": 26,
-        "constraints": lambda x: 1 <= x <= 100,
+        "constraints": _is_valid_steps,
     },
     "cfg": {
         "type": (int, float),
         "required": False,
         "default": 4.0,
-        "constraints": lambda x: 1.0 <= x <= 20.0,
+        "constraints": _is_valid_cfg,
     },
     "width": {
         "type": int,
         "required": False,
         "default": 1024,
-        "constraints": lambda x: x in [512, 768, 1024, 1280, 1536],
+        "constraints": _is_allowed_dimension,
     },
     "height": {
         "type": int,
         "required": False,
         "default": 1024,
-        "constraints": lambda x: x in [512, 768, 1024, 1280, 1536],
+        "constraints": _is_allowed_dimension,
     },
     "return_format": {
         "type": str,
         "required": False,
         "default": "base64",
-        "constraints": lambda x: x in ["base64", "url"],
+        "constraints": _is_return_format,
     },
 }
 
 # Required node types for a valid workflow
-REQUIRED_NODE_TYPES = [
+REQUIRED_NODE_TYPES: FrozenSet[str] = frozenset({
     "UNETLoader",
     "CLIPLoader",
     "VAELoader",
     "KSampler",
-]
+})
 
 # Output node types (at least one required)
-OUTPUT_NODE_TYPES = [
+OUTPUT_NODE_TYPES: FrozenSet[str] = frozenset({
     "SaveImage",
     "PreviewImage",
-]
+})
+
+
+# Marker for schema fields without a default value
+_NO_DEFAULT = object()
+
+
+def _compile_schema(
+    schema: Dict[str, Dict[str, Any]]
+) -> Tuple[Tuple[str, Any, Any, Optional[Callable[[Any], bool]]], ...]:
+    """
+    Flatten schema rules into (key, type, default, constraint) tuples.
+    
+    Args:
+        schema: Input schema definition
+        
+    Returns:
+        Tuple of compiled field rules
+    """
+    return tuple(
+        (key, rules["type"], rules.get("default", _NO_DEFAULT), rules.get("constraints"))
+        for key, rules in schema.items()
+    )
+
+
+# Schema rules compiled once at import time
+_COMPILED_SCHEMA = _compile_schema(INPUT_SCHEMA)
+_FIELD_TYPES = {key: field_type for key, field_type, _, _ in _COMPILED_SCHEMA}
+
+
+def _validate_fields(raw_input: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Check input fields against the compiled schema, applying defaults.
+    
+    Unknown keys and type errors are reported before constraint errors,
+    each as one ValueError listing every problem.
+    
+    Args:
+        raw_input: Raw input dictionary from job
+        
+    Returns:
+        Input with defaults applied
+        
+    Raises:
+        ValueError: If validation fails
+    """
+    type_errors = [
+        (key, f"{key}: unexpected input")
+        for key in raw_input.keys() - _FIELD_TYPES.keys()
+    ]
+    constraint_errors = []
+    validated = {}
+    
+    for key, field_type, default, constraint in _COMPILED_SCHEMA:
+        if key in raw_input:
+            value = raw_input[key]
+            if not isinstance(value, field_type):
+                type_errors.append((key, f"{key}: expected {field_type}, got {type(value)}"))
+            elif constraint is not None and not constraint(value):
+                constraint_errors.append(f"{key}: does not meet the constraints")
+            validated[key] = value
+        elif default is not _NO_DEFAULT:
+            validated[key] = default
+    
+    if type_errors:
+        type_errors.sort()
+        raise ValueError("Validation errors: " + ", ".join(m for _, m in type_errors))
+    if constraint_errors:
+        raise ValueError("Validation errors: " + ", ".join(constraint_errors))
+    return validated
+
+
+# Inputs that can skip the field validator entirely
+_WORKFLOW_ONLY_KEYS = frozenset(("workflow", "return_format"))
+_DEFAULT_RETURN_FORMAT = INPUT_SCHEMA["return_format"]["default"]
+
+
+@dataclass(frozen=True, slots=True)
+class ValidatedInput:
+    """
+    Job input after validation, with schema defaults applied.
+    
+    Fields are read as attributes; read-only mapping access
+    (validated["seed"], "seed" in validated, .get(), .keys()) is kept for
+    callers written against the previous dict result. Fields that were
+    not provided and have no default are None and count as absent.
+    """
+    
+    workflow: Optional[Dict[str, Any]] = None
+    prompt: Optional[str] = None
+    negative_prompt: str = INPUT_SCHEMA["negative_prompt"]["default"]
+    seed: int = INPUT_SCHEMA["seed"]["default"]
+    steps: int = INPUT_SCHEMA["steps"]["default"]
+    cfg: float = INPUT_SCHEMA["cfg"]["default"]
+    width: int = INPUT_SCHEMA["width"]["default"]
+    height: int = INPUT_SCHEMA["height"]["default"]
+    return_format: str = INPUT_SCHEMA["return_format"]["default"]
+    
+    def __getitem__(self, key: str) -> Any:
+        if key not in self:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def __contains__(self, key: object) -> bool:
+        return key in _FIELD_TYPES and getattr(self, key) is not None
+    
+    def get(self, key: str, default: Any = None) -> Any:
+        """Return a field value, or default if it is absent."""
+        return self[key] if key in self else default
+    
+    def keys(self) -> FrozenSet[str]:
+        """Return the names of fields that are present."""
+        return frozenset(key for key in _FIELD_TYPES if key in self)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Return present fields as a plain dictionary."""
+        return {key: getattr(self, key) for key in _FIELD_TYPES if key in self}
 
 
-def validate_input(raw_input: Dict[str, Any]) -> Dict[str, Any]:
+def validate_input(raw_input: Dict[str, Any]) -> ValidatedInput:
     """
     Validate input against schema.
     
+    A workflow may be given either as an object or as a JSON string.
+    
     Args:
         raw_input: Raw input dictionary from job
         
     Returns:
-        Dict with either 'validated_input' or 'errors'
+        ValidatedInput with defaults applied
         
     Raises:
         ValueError: If validation fails
     """
+    # Workflows sent as JSON text are parsed here so the rest of the
+    # pipeline only ever sees dicts (and "{}" counts as no workflow below)
+    if isinstance(raw_input.get("workflow"), str) and raw_input["workflow"]:
+        try:
+            workflow = orjson.loads(raw_input["workflow"])
+        except orjson.JSONDecodeError as e:
+            raise ValueError(f"Validation errors: workflow: invalid JSON ({e})")
+        raw_input = {**raw_input, "workflow": workflow}
+    
     # Check if either workflow or prompt is provided
     has_workflow = "workflow" in raw_input and raw_input["workflow"]
     has_prompt = "prompt" in raw_input and raw_input["prompt"]
@@ -99,18 +269,51 @@ def validate_input(raw_input: Dict[str, Any]) -> Dict[str, Any]:
             "Missing required field: Either 'workflow' or 'prompt' must be provided"
         )
     
-    # Validate against schema
-    result = validate(raw_input, INPUT_SCHEMA)
+    # Workflow-only requests (the common pre-built workflow case) carry no
+    # override fields, so there is nothing else to check
+    if (
+        raw_input.keys() <= _WORKFLOW_ONLY_KEYS
+        and isinstance(raw_input["workflow"], dict)
+        and isinstance(raw_input.get("return_format", _DEFAULT_RETURN_FORMAT), str)
+        and raw_input.get("return_format", _DEFAULT_RETURN_FORMAT) in RETURN_FORMATS
+    ):
+        logger.debug("Input validation successful", extra={"workflow_only": True})
+        return ValidatedInput(
+            workflow=raw_input["workflow"],
+            return_format=raw_input.get("return_format", _DEFAULT_RETURN_FORMAT)
+        )
     
-    if "errors" in result:
-        error_messages = [f"{k}: {v}" for k, v in result["errors"].items()]
-        raise ValueError(f"Validation errors: {', '.join(error_messages)}")
+    # Check types and constraints, applying defaults
+    validated_input = _validate_fields(raw_input)
     
-    logger.info("Input validation successful", extra={
-        "validated_input": result["validated_input"]
+    logger.debug("Input validation successful", extra={
+        "validated_input": validated_input
     })
     
-    return result["validated_input"]
+    return ValidatedInput(**validated_input)
+
+
+def _workflow_soa(workflow: Dict[str, Any]) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """
+    Split a workflow into parallel node id and class type sequences.
+    
+    Non-dict entries are skipped.
+    
+    Args:
+        workflow: ComfyUI workflow dictionary
+        
+    Returns:
+        (node_ids, class_types) tuples of equal length
+    """
+    nodes = [
+        (node_id, node_data.get("class_type", ""))
+        for node_id, node_data in workflow.items()
+        if isinstance(node_data, dict)
+    ]
+    if not nodes:
+        return (), ()
+    node_ids, class_types = zip(*nodes)
+    return node_ids, class_types
 
 
 def validate_workflow_structure(workflow: Dict[str, Any]) -> bool:
@@ -132,43 +335,183 @@ def validate_workflow_structure(workflow: Dict[str, Any]) -> bool:
     if not workflow:
         raise ValueError("Workflow cannot be empty")
     
-    # Check for required node types
-    found_node_types = set()
-    has_output_node = False
-    
-    for node_id, node_data in workflow.items():
-        if not isinstance(node_data, dict):
-            continue
-        
-        class_type = node_data.get("class_type", "")
-        found_node_types.add(class_type)
-        
-        if class_type in OUTPUT_NODE_TYPES:
-            has_output_node = True
-    
-    # Check for required nodes
-    missing_nodes = []
-    for node_type in REQUIRED_NODE_TYPES:
-        if node_type not in found_node_types:
-            missing_nodes.append(node_type)
+    # Check for required node types with set operations over the class types
+    found_node_types = {
+        node_data.get("class_type", "")
+        for node_data in workflow.values()
+        if isinstance(node_data, dict)
+    }
+    missing_nodes = REQUIRED_NODE_TYPES - found_node_types
     
     if missing_nodes:
         raise ValueError(
-            f"Workflow is missing required node types: {', '.join(missing_nodes)}"
+            f"Workflow is missing required node types: {', '.join(sorted(missing_nodes))}"
         )
     
-    if not has_output_node:
+    if found_node_types.isdisjoint(OUTPUT_NODE_TYPES):
         raise ValueError(
-            f"Workflow must contain at least one output node type: {', '.join(OUTPUT_NODE_TYPES)}"
+            f"Workflow must contain at least one output node type: {', '.join(sorted(OUTPUT_NODE_TYPES))}"
         )
     
-    logger.info("Workflow structure validation successful", extra={
+    logger.debug("Workflow structure validation successful", extra={
         "node_types": list(found_node_types)
     })
     
     return True
 
 
+def _class_index(workflow: Dict[str, Any]) -> Dict[str, Tuple[str, ...]]:
+    """
+    Group workflow node ids by class type.
+    
+    Args:
+        workflow: ComfyUI workflow dictionary
+        
+    Returns:
+        Mapping of class type to node ids (in workflow order)
+    """
+    index: Dict[str, List[str]] = defaultdict(list)
+    for node_id, class_type in zip(*_workflow_soa(workflow)):
+        index[class_type].append(node_id)
+    return {class_type: tuple(node_ids) for class_type, node_ids in index.items()}
+
+
+def _prompt_links(
+    workflow: Dict[str, Any],
+    index: Dict[str, Tuple[str, ...]]
+) -> Dict[str, FrozenSet[str]]:
+    """
+    Find the CLIPTextEncode nodes wired into KSampler conditioning inputs.
+    
+    In the API format a linked input is [source_node_id, output_slot].
+    
+    Args:
+        workflow: ComfyUI workflow dictionary
+        index: Class type index of the workflow
+        
+    Returns:
+        Mapping of "positive"/"negative" to the prompt node ids feeding
+        them (empty if the conditioning does not come straight from one)
+    """
+    links: Dict[str, set] = {"positive": set(), "negative": set()}
+    for sampler_id in index.get("KSampler", ()):
+        inputs = workflow[sampler_id].get("inputs", {})
+        for role, node_ids in links.items():
+            link = inputs.get(role)
+            if not isinstance(link, list) or not link:
+                continue
+            source = workflow.get(str(link[0]))
+            if isinstance(source, dict) and source.get("class_type") == "CLIPTextEncode":
+                node_ids.add(str(link[0]))
+    return {role: frozenset(node_ids) for role, node_ids in links.items()}
+
+
+@functools.lru_cache(maxsize=1)
+def _default_class_index() -> Dict[str, Tuple[str, ...]]:
+    """Class type index of the shared default workflow (built once)."""
+    return _class_index(_load_default_workflow_cached())
+
+
+@functools.lru_cache(maxsize=1)
+def _default_prompt_links() -> Dict[str, FrozenSet[str]]:
+    """Prompt node links of the shared default workflow (found once)."""
+    return _prompt_links(_load_default_workflow_cached(), _default_class_index())
+
+
+def _is_shared_default(workflow: Dict[str, Any]) -> bool:
+    """
+    Check whether workflow is the cached default workflow itself.
+    
+    Args:
+        workflow: ComfyUI workflow dictionary
+        
+    Returns:
+        True if workflow is the shared default workflow object
+    """
+    # Only compare against the default workflow if it has already been loaded
+    return bool(
+        _load_default_workflow_cached.cache_info().currsize
+        and workflow is _load_default_workflow_cached()
+    )
+
+
+class _WorkflowPatch:
+    """
+    Copy-on-write view of a workflow.
+    
+    The node mapping is copied shallowly and a node (with its inputs) is
+    only copied the first time one of its inputs is written, so the
+    original workflow is never modified and untouched nodes stay shared.
+    Nodes are indexed by class type once, so each override goes straight
+    to its target nodes.
+    """
+    
+    def __init__(
+        self,
+        workflow: Dict[str, Any],
+        index: Optional[Dict[str, Tuple[str, ...]]] = None,
+        prompt_links: Optional[Dict[str, FrozenSet[str]]] = None
+    ):
+        self.workflow = dict(workflow)
+        self._copied = set()
+        self._index = index if index is not None else _class_index(workflow)
+        self.prompt_links = (
+            prompt_links if prompt_links is not None
+            else _prompt_links(workflow, self._index)
+        )
+    
+    def nodes(self, class_type: str):
+        """Yield (node_id, inputs) for all nodes of a class type (read-only)."""
+        for node_id in self._index.get(class_type, ()):
+            yield node_id, self.workflow[node_id].get("inputs", {})
+    
+    def set_input(self, node_id: str, field: str, value: Any) -> None:
+        """Set a node input, copying the node on first write."""
+        if node_id not in self._copied:
+            node_data = self.workflow[node_id]
+            self.workflow[node_id] = {
+                **node_data,
+                "inputs": dict(node_data.get("inputs", {}))
+            }
+            self._copied.add(node_id)
+        self.workflow[node_id]["inputs"][field] = value
+
+
+def _is_positive_prompt(patch: _WorkflowPatch, node_id: str, inputs: Dict[str, Any]) -> bool:
+    """Match the prompt node(s) feeding KSampler's positive input."""
+    linked = patch.prompt_links["positive"]
+    if linked:
+        return node_id in linked
+    # Conditioning isn't wired straight from a prompt node; set them all
+    return "text" in inputs
+
+
+def _is_negative_prompt(patch: _WorkflowPatch, node_id: str, inputs: Dict[str, Any]) -> bool:
+    """Match the prompt node(s) feeding KSampler's negative input."""
+    linked = patch.prompt_links["negative"]
+    if linked:
+        return node_id in linked
+    # Fall back to recognizing the text of a typical negative prompt
+    current_text = inputs.get("text", "")
+    return "low quality" in current_text or "blurry" in current_text
+
+
+# Override key -> (node class type, input field, node filter or None),
+# applied in this order
+_OVERRIDE_PLAN: Dict[
+    str,
+    Tuple[str, str, Optional[Callable[[_WorkflowPatch, str, Dict[str, Any]], bool]]]
+] = {
+    "prompt": ("CLIPTextEncode", "text", _is_positive_prompt),
+    "negative_prompt": ("CLIPTextEncode", "text", _is_negative_prompt),
+    "seed": ("KSampler", "seed", None),
+    "steps": ("KSampler", "steps", None),
+    "cfg": ("KSampler", "cfg", None),
+    "width": ("EmptySD3LatentImage", "width", None),
+    "height": ("EmptySD3LatentImage", "height", None),
+}
+
+
 def apply_overrides(
     workflow: Dict[str, Any],
     overrides: Dict[str, Any]
@@ -181,78 +524,73 @@ def apply_overrides(
         overrides: Parameters to override (prompt, seed, steps, etc.)
         
     Returns:
-        Modified workflow
+        Modified workflow (nodes without overrides are shared with the
+        original, which is never modified)
     """
-    # Create a deep copy to avoid modifying the original
-    modified_workflow = copy.deepcopy(workflow)
+    if _is_shared_default(workflow):
+        patch = _WorkflowPatch(workflow, _default_class_index(), _default_prompt_links())
+    else:
+        patch = _WorkflowPatch(workflow)
     
-    # Find and apply overrides
-    for node_id, node_data in modified_workflow.items():
-        if not isinstance(node_data, dict):
+    for key, (class_type, field, node_filter) in _OVERRIDE_PLAN.items():
+        if key not in overrides:
             continue
-        
-        class_type = node_data.get("class_type", "")
-        inputs = node_data.get("inputs", {})
-        
-        # Override prompt in CLIPTextEncode nodes
-        if class_type == "CLIPTextEncode" and "prompt" in overrides:
-            # Check if this is the positive prompt node (node 6 in our workflow)
-            # We can identify it by checking if it's connected to KSampler
-            if "text" in inputs:
-                # For now, we'll override all CLIPTextEncode nodes
-                # In a more sophisticated implementation, we'd check connections
-                inputs["text"] = overrides["prompt"]
-        
-        # Override negative prompt
-        if class_type == "CLIPTextEncode" and "negative_prompt" in overrides:
-            if "text" in inputs:
-                # Check if this looks like a negative prompt
-                current_text = inputs.get("text", "")
-                if "low quality" in current_text or "blurry" in current_text:
-                    inputs["text"] = overrides["negative_prompt"]
-        
-        # Override KSampler parameters
-        if class_type == "KSampler":
-            if "seed" in overrides:
-                inputs["seed"] = overrides["seed"]
-            if "steps" in overrides:
-                inputs["steps"] = overrides["steps"]
-            if "cfg" in overrides:
-                inputs["cfg"] = overrides["cfg"]
-        
-        # Override dimensions in EmptySD3LatentImage
-        if class_type == "EmptySD3LatentImage":
-            if "width" in overrides:
-                inputs["width"] = overrides["width"]
-            if "height" in overrides:
-                inputs["height"] = overrides["height"]
+        value = overrides[key]
+        for node_id, inputs in patch.nodes(class_type):
+            if node_filter is None or node_filter(patch, node_id, inputs):
+                patch.set_input(node_id, field, value)
     
     logger.info("Applied parameter overrides", extra={
         "overrides": overrides
     })
     
-    return modified_workflow
+    return patch.workflow
 
 
-def load_default_workflow() -> Dict[str, Any]:
+@functools.lru_cache(maxsize=1)
+def _load_default_workflow_cached() -> Dict[str, Any]:
     """
-    Load the default workflow from workflow.json.
+    Read and parse workflow.json once per process.
     
     Returns:
-        Default workflow dictionary
-        
-    Raises:
-        FileNotFoundError: If workflow.json doesn't exist
-        json.JSONDecodeError: If workflow.json is invalid JSON
+        Parsed default workflow (shared; must not be modified)
     """
     try:
-        with open("workflow.json", "r") as f:
-            workflow = json.load(f)
+        workflow = orjson.loads(DEFAULT_WORKFLOW_PATH.read_bytes())
+        # Intern class types so comparisons and index lookups against the
+        # (already interned) literals in this module hit the identity fast path
+        for node_data in workflow.values():
+            if isinstance(node_data, dict) and isinstance(node_data.get("class_type"), str):
+                node_data["class_type"] = sys.intern(node_data["class_type"])
         logger.info("Loaded default workflow from workflow.json")
         return workflow
     except FileNotFoundError:
         logger.error("workflow.json not found")
         raise FileNotFoundError("Default workflow file (workflow.json) not found")
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         logger.error(f"Invalid JSON in workflow.json: {e}")
         raise
+
+
+def load_default_workflow(shared: bool = False) -> Dict[str, Any]:
+    """
+    Load the default workflow from workflow.json.
+    
+    The file is parsed once and cached for the lifetime of the process.
+    
+    Args:
+        shared: Return the cached workflow itself instead of a copy.
+            Only use this for read-only access (apply_overrides copies
+            before modifying).
+    
+    Returns:
+        Default workflow dictionary
+        
+    Raises:
+        FileNotFoundError: If workflow.json doesn't exist
+        orjson.JSONDecodeError: If workflow.json is invalid JSON
+    """
+    workflow = _load_default_workflow_cached()
+    if shared:
+        return workflow
+    return copy.deepcopy(workflow)